@@ -1,22 +1,20 @@
 # Copyright (C) 2025 Aakash Shankar
 
 import argparse
+import calendar
 import csv
 import os
+import re
 import sys
-from datetime import datetime, timedelta, timezone
-
-try:
-    from .ingest import ingest
-except ImportError:
-    print("Error: Ensure 'ingest.py' exists and contains the 'ingest' function.", file=sys.stderr)
-    sys.exit(1)
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from .config import (
-        TARGET_VARIABLES, S3_BUCKET, CYCLE, FILE_TYPE,
+        TARGET_VARIABLES, ALL_VARIABLE_NAMES, S3_BUCKET, CYCLE, FILE_TYPE,
         FORECAST_HOURS_START, FORECAST_HOURS_END,
-        DUCKDB_FILE, TABLE_NAME
+        DUCKDB_FILE, TABLE_NAME, MAX_WORKERS, GRID_CACHE_DIR, INSERT_BATCH_SIZE, PREFETCH_FILES,
+        RANGE_FETCHES, DUCKDB_THREADS, DUCKDB_MEMORY_LIMIT
     )
 except ImportError:
     print("Error: Ensure 'config.py' exists and contains necessary constants "
@@ -24,31 +22,198 @@ except ImportError:
     sys.exit(1)
 
 
+_RUN_DATE_RE = re.compile(r'^(\d{4})(\d{2})(\d{2})$')
+
+
+def _validate_run_date(run_date):
+    """Raises ValueError unless run_date is a real calendar date in YYYYMMDD form."""
+    m = _RUN_DATE_RE.match(run_date)
+    if not m:
+        raise ValueError(f"Not in YYYYMMDD form: {run_date}")
+    year, month, day = map(int, m.groups())
+    if not (1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]):
+        raise ValueError(f"Not a valid calendar date: {run_date}")
+
+
+def _is_float(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _sniff_points_file(filepath):
+    """
+    Sniffs the first line of a CSV file.
+
+    Returns:
+        A tuple: (has_header, num_columns)
+        has_header (bool): Whether the first line is a header, i.e. its first two fields aren't both numbers.
+        num_columns (int): Number of fields in the first line.
+    """
+    with open(filepath, 'r', newline='') as csvfile:
+        first_fields = next(csv.reader([csvfile.readline().rstrip('\r\n')]), [])
+    has_header = bool(first_fields) and not all(_is_float(f) for f in first_fields[:2])
+    return has_header, len(first_fields)
+
+
+# Files larger than this are memory-mapped instead of read through buffered IO
+_MMAP_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+_NUMERIC_RE = r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+
+
+def _column_to_float64(column):
+    """Casts a string column to float64, turning non-numeric cells into nulls."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    is_numeric = pc.match_substring_regex(column, _NUMERIC_RE)
+    return pc.cast(pc.if_else(is_numeric, pc.utf8_trim_whitespace(column), None), pa.float64())
+
+
+def _read_points_lines(data, has_header):
+    """
+    Slow path for ragged or non-numeric files: splits raw CSV bytes into one row
+    per line so row numbers match the file. Rows with fewer than two fields get
+    null lat/lon and short=True; extra fields are ignored.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    lines = pc.split_pattern(pa.array([data], pa.large_binary()).cast(pa.large_string()), '\n')[0].values
+    if len(lines) and lines[-1].as_py() in ('', '\r'):
+        lines = lines[:-1] # Trailing newline at end of file
+    if has_header:
+        lines = lines[1:]
+    lines = pc.utf8_rtrim(lines, '\r')
+    short = pc.less(pc.list_value_length(pc.split_pattern(lines, ',', max_splits=2)), 2)
+    fields = pc.split_pattern(pc.if_else(short, ',', lines), ',', max_splits=2)
+    lat = _column_to_float64(pc.utf8_trim(pc.list_element(fields, 0), '"'))
+    lon = _column_to_float64(pc.utf8_trim(pc.list_element(fields, 1), '"'))
+    return pa.table({'lat': lat, 'lon': lon, 'short': short})
+
+
+def _read_points_table(source, has_header, num_columns=None, use_threads=True):
+    """
+    Reads the first two CSV columns into an Arrow table of float64 'lat'/'lon'
+    columns plus a 'short' flag for rows with fewer than two fields. There is
+    one row per line after the header, so row i is line i + 1 (+1 with header).
+
+    num_columns is the field count of the file's first line; passing it pins
+    the schema so every chunk of a file is parsed the same way. If None, it is
+    inferred from the first row parsed.
+    """
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+
+    invalid_rows = []
+    if num_columns is None or num_columns >= 2:
+        names = {'autogenerate_column_names': True} if num_columns is None else \
+            {'column_names': [f'f{i}' for i in range(num_columns)]}
+        read_options = pacsv.ReadOptions(skip_rows=1 if has_header else 0, use_threads=use_threads, **names)
+        # Rows with a different field count are only noted here; any one sends the file down the slow path
+        parse_options = pacsv.ParseOptions(ignore_empty_lines=False,
+                                           invalid_row_handler=lambda row: invalid_rows.append(row) or 'skip')
+        try:
+            tbl = pacsv.read_csv(source, read_options=read_options, parse_options=parse_options,
+                                 convert_options=pacsv.ConvertOptions(
+                                     include_columns=['f0', 'f1'],
+                                     column_types={'f0': pa.float64(), 'f1': pa.float64()}))
+            if not invalid_rows:
+                return pa.table({'lat': tbl['f0'], 'lon': tbl['f1'],
+                                 'short': pa.nulls(tbl.num_rows, pa.bool_()).fill_null(False)})
+        except (pa.ArrowInvalid, pa.ArrowKeyError):
+            pass # Some cell is not a number
+
+    if hasattr(source, 'seek'):
+        source.seek(0)
+        data = source.read()
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+    return _read_points_lines(data, has_header)
+
+
+def _line_aligned_ranges(mapped_file, num_chunks):
+    """Splits a memory-mapped file into byte ranges that each start at the beginning of a line."""
+    size = mapped_file.size()
+    bounds = [0]
+    for i in range(1, num_chunks):
+        pos = max(size * i // num_chunks, bounds[-1])
+        while pos < size:
+            window = mapped_file.read_at(min(64 * 1024, size - pos), pos)
+            newline_at = window.find(b'\n')
+            if newline_at != -1:
+                pos += newline_at + 1
+                break
+            pos += len(window)
+        bounds.append(min(pos, size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _read_points_table_parallel(mapped_file, has_header, num_columns):
+    """Parses line-aligned chunks of a memory-mapped CSV concurrently and concatenates the results."""
+    import pyarrow as pa
+
+    ranges = _line_aligned_ranges(mapped_file, os.cpu_count() or 1)
+    mapped_file.seek(0)
+    whole = mapped_file.read_buffer()
+
+    def read_chunk(chunk_num, start, end):
+        # Only the first chunk can contain the header; each chunk parses single-threaded
+        return _read_points_table(pa.BufferReader(whole.slice(start, end - start)),
+                                  has_header and chunk_num == 0, num_columns, use_threads=False)
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        tables = list(executor.map(read_chunk, range(len(ranges)), *zip(*ranges)))
+    return pa.concat_tables(tables)
+
+
 def parse_target_points_file(filepath):
-    """Reads a CSV file containing latitude,longitude pairs."""
-    points = []
+    """Reads a CSV file containing latitude,longitude pairs into an (N, 2) float64 array."""
+    # pyarrow is imported lazily throughout this module so `--help` and argument errors stay fast
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
     if not os.path.exists(filepath):
         print(f"Error: Target points file not found: {filepath}", file=sys.stderr)
         sys.exit(1)
 
     try:
-        with open(filepath, 'r', newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            header = next(reader, None) # Skip header row if present
-            print(f"Reading target points from: {filepath} (Skipped header: {header})")
-            for i, row in enumerate(reader):
-                if len(row) >= 2:
-                    try:
-                        lat = float(row[0].strip())
-                        lon = float(row[1].strip())
-                        if -90 <= lat <= 90 and -180 <= lon <= 180:
-                             points.append((lat, lon))
-                        else:
-                             print(f"Warning: Skipping row {i+2} in {filepath}: Invalid lat/lon values ({lat},{lon})", file=sys.stderr)
-                    except ValueError:
-                        print(f"Warning: Skipping row {i+2} in {filepath}: Non-numeric lat/lon values ('{row[0]}','{row[1]}')", file=sys.stderr)
-                else:
-                    print(f"Warning: Skipping row {i+2} in {filepath}: Row does not contain at least 2 columns.", file=sys.stderr)
+        has_header, num_columns = _sniff_points_file(filepath)
+        print(f"Reading target points from: {filepath} (Header detected: {has_header})")
+        if os.path.getsize(filepath) > _MMAP_THRESHOLD_BYTES:
+            with pa.memory_map(filepath, 'r') as mapped_file:
+                tbl = _read_points_table_parallel(mapped_file, has_header, num_columns)
+        else:
+            tbl = _read_points_table(filepath, has_header, num_columns)
+
+        lat, lon = tbl['lat'], tbl['lon']
+        mask = pc.and_(pc.and_(pc.greater_equal(lat, -90), pc.less_equal(lat, 90)),
+                       pc.and_(pc.greater_equal(lon, -180), pc.less_equal(lon, 180)))
+        mask = pc.fill_null(mask, False)
+
+        if tbl.num_rows == 0:
+            print(f"Error: No valid target points found in file: {filepath}", file=sys.stderr)
+            sys.exit(1)
+
+        first_row_num = 2 if has_header else 1
+        short = tbl['short']
+        warnings = [
+            f"Warning: Skipping row {i + first_row_num} in {filepath}: Row does not contain at least 2 columns."
+            if short[i].as_py() else
+            f"Warning: Skipping row {i + first_row_num} in {filepath}: Invalid or non-numeric lat/lon values ({lat[i]},{lon[i]})"
+            for i in np.flatnonzero(~mask.to_numpy()).tolist()
+        ]
+        if warnings:
+            sys.stderr.write('\n'.join(warnings) + '\n')
+
+        filtered = tbl.filter(mask)
+        points = np.column_stack((filtered['lat'].to_numpy(), filtered['lon'].to_numpy()))
     except IOError as e:
         print(f"Error reading target points file {filepath}: {e}", file=sys.stderr)
         sys.exit(1)
@@ -56,7 +221,7 @@ def parse_target_points_file(filepath):
         print(f"An unexpected error occurred while parsing {filepath}: {e}", file=sys.stderr)
         sys.exit(1)
 
-    if not points:
+    if len(points) == 0:
         print(f"Error: No valid target points found in file: {filepath}", file=sys.stderr)
         sys.exit(1)
 
@@ -116,59 +281,68 @@ def main_cli():
 
     args = parser.parse_args()
 
+    # Happy-path status lines are collected and written once, right before ingestion starts
+    status_msgs = []
+
     # 1. Determine Run Date
     run_date_to_use = args.run_date
     if run_date_to_use is None:
         # Default to yesterday UTC
-        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
-        run_date_to_use = yesterday.strftime("%Y%m%d")
-        print(f"No --run-date provided, defaulting to yesterday (UTC): {run_date_to_use}")
+        yesterday = time.gmtime(time.time() - 86400)
+        run_date_to_use = f"{yesterday.tm_year:04d}{yesterday.tm_mon:02d}{yesterday.tm_mday:02d}"
+        status_msgs.append(f"No --run-date provided, defaulting to yesterday (UTC): {run_date_to_use}")
     else:
         # Validate format if provided
         try:
-            datetime.strptime(run_date_to_use, "%Y%m%d")
-            print(f"Using specified --run-date: {run_date_to_use}")
+            _validate_run_date(run_date_to_use)
+            status_msgs.append(f"Using specified --run-date: {run_date_to_use}")
         except ValueError:
             print(f"Error: Invalid --run-date format '{run_date_to_use}'. Please use YYYYMMDD.", file=sys.stderr)
             sys.exit(1)
 
     # 2. Determine Variables
     variables_to_use = []
-    all_variable_names = {v['user_name'] for v in TARGET_VARIABLES} # Set for quick lookup
 
     if args.variables is None:
         variables_to_use = TARGET_VARIABLES # Use all default variables
-        print(f"No --variables specified, ingesting all {len(variables_to_use)} supported variables.")
+        status_msgs.append(f"No --variables specified, ingesting all {len(variables_to_use)} supported variables.")
     else:
-        requested_names = {v.strip() for v in args.variables.split(',') if v.strip()}
-        print(f"Requested variables: {', '.join(sorted(list(requested_names)))}")
-        variables_to_use = [v for v in TARGET_VARIABLES if v['user_name'] in requested_names]
+        requested_names = frozenset(filter(None, map(str.strip, args.variables.split(','))))
+        status_msgs.append(f"Requested variables: {', '.join(sorted(list(requested_names)))}")
+        variables_to_use = [v for v in TARGET_VARIABLES if v["user_name"] in requested_names]
 
         # Validation
-        found_names = {v['user_name'] for v in variables_to_use}
-        missing_names = requested_names - found_names
+        missing_names = requested_names - ALL_VARIABLE_NAMES
         if missing_names:
             print(f"Warning: The following requested variables are not supported or misspelled and will be ignored: {', '.join(sorted(list(missing_names)))}", file=sys.stderr)
-            print(f"Supported variables are: {', '.join(sorted(list(all_variable_names)))}", file=sys.stderr)
+            print(f"Supported variables are: {', '.join(sorted(ALL_VARIABLE_NAMES))}", file=sys.stderr)
 
         if not variables_to_use:
             print(f"Error: No valid variables selected after filtering. Please check the --variables argument.", file=sys.stderr)
             sys.exit(1)
-        print(f"Ingesting {len(variables_to_use)} specified variable(s).")
+        status_msgs.append(f"Ingesting {len(variables_to_use)} specified variable(s).")
 
     # 3. Determine Target Points
-    target_points_list = parse_target_points_file(args.target_points_file)
+    target_points = parse_target_points_file(args.target_points_file)
 
     # 4. Number of Hours (already validated by argparse)
     num_hours_to_use = args.num_hours
     if num_hours_to_use <= 0:
          print(f"Error: --num-hours must be positive.", file=sys.stderr)
          sys.exit(1)
-    print(f"Looking back {num_hours_to_use} hours for {CYCLE}Z runs.")
+    status_msgs.append(f"Looking back {num_hours_to_use} hours for {CYCLE}Z runs.")
+
 
+    # Deferred until arguments are validated: ingest pulls in duckdb, eccodes, boto3 and scipy
+    try:
+        from .ingest import ingest
+    except ImportError as e:
+        print(f"Error: Could not import the ingestion module ({e}). Ensure 'ingest.py' exists and its dependencies are installed.", file=sys.stderr)
+        sys.exit(1)
 
     # --- Call the Ingestion Logic ---
-    print("\nStarting data ingestion...")
+    status_msgs.append("\nStarting data ingestion...")
+    sys.stdout.write('\n'.join(status_msgs) + '\n')
     try:
         ingest(
             run_date=run_date_to_use,
@@ -178,10 +352,17 @@ def main_cli():
             f_start=FORECAST_HOURS_START,
             f_end=FORECAST_HOURS_END,
             target_vars=variables_to_use,
-            target_points=target_points_list,
+            target_points=target_points,
             db_filename=args.db_file,
             table_name=args.table_name,
-            s3_bucket=S3_BUCKET
+            s3_bucket=S3_BUCKET,
+            max_workers=MAX_WORKERS,
+            grid_cache_dir=GRID_CACHE_DIR,
+            insert_batch_size=INSERT_BATCH_SIZE,
+            prefetch_files=PREFETCH_FILES,
+            range_fetches=RANGE_FETCHES,
+            duckdb_threads=DUCKDB_THREADS,
+            duckdb_memory_limit=DUCKDB_MEMORY_LIMIT
         )
         print("\nIngestion process completed.")
     except Exception as e:
@@ -1,4 +1,7 @@
 # Copyright (C) 2025 Aakash Shankar
+import os
+from types import MappingProxyType
+
 S3_BUCKET = "noaa-hrrr-bdp-pds"
 RUN_DATE = "20150323"  # The most recent date for the 06Z run to include
 NUM_HOURS = 48
@@ -7,48 +10,76 @@ FILE_TYPE = "wrfsfc"
 FORECAST_HOURS_START = 0
 FORECAST_HOURS_END = 15
 
+MAX_WORKERS = 8  # Concurrent GRIB files decoded during ingest
+PREFETCH_FILES = 4  # Concurrent S3 downloads running ahead of the decode workers
+RANGE_FETCHES = 16  # Concurrent ranged S3 GETs for individual GRIB messages, shared by all downloads
+
+# Nearest-point lookups per (grid, target points), reused across runs
+GRID_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "zekrom", "grids")
+
 DUCKDB_FILE = "data.duckdb"
 TABLE_NAME = "hrrr_forecasts"
+INSERT_BATCH_SIZE = 50_000  # Rows accumulated across files before each DuckDB insert
+DUCKDB_THREADS = 8  # Threads DuckDB may use for bulk inserts
+DUCKDB_MEMORY_LIMIT = "4GB"  # Cap on DuckDB's memory use during ingest
 
 
-TARGET_VARIABLES = [
+# Read-only: entries are MappingProxyType views so callers cannot mutate shared config.
+# "idx" is the VAR:level field pair of the message in the file's .idx sidecar, used to range-fetch only
+# the messages we need; the remaining keys are GRIB keys checked against each decoded message.
+TARGET_VARIABLES = tuple(MappingProxyType(v) for v in [
     {
         "user_name": "surface_pressure",
         "shortName": "sp", "typeOfLevel": "surface", "level": 0,
+        "idx": "PRES:surface",
     }, {
         "user_name": "surface_roughness",
         "shortName": "sro", "typeOfLevel": "surface", "level": 0, # From HRRRv4 docs
+        "idx": "SFCR:surface",
     }, {
         "user_name": "visible_beam_downward_solar_flux",
         "shortName": "fdir", "typeOfLevel": "surface", "level": 0, # From HRRRv4 docs
+        "idx": "VBDSF:surface",
     }, {
         "user_name": "visible_diffuse_downward_solar_flux",
         "shortName": "ssrd", "typeOfLevel": "surface", "level": 0, # From HRRRv4 docs
+        "idx": "VDDSF:surface",
     }, {
         "user_name": "temperature_2m",
         "shortName": "2t", "typeOfLevel": "heightAboveGround", "level": 2,
+        "idx": "TMP:2 m above ground",
     }, {
         "user_name": "dewpoint_2m",
         "shortName": "2d", "typeOfLevel": "heightAboveGround", "level": 2,
+        "idx": "DPT:2 m above ground",
     }, {
         "user_name": "relative_humidity_2m",
         "shortName": "r", "typeOfLevel": "heightAboveGround", "level": 2, # From HRRRv4 docs
+        "idx": "RH:2 m above ground",
     }, {
         "user_name": "u_component_wind_10m",
         "shortName": "10u", "typeOfLevel": "heightAboveGround", "level": 10,
+        "idx": "UGRD:10 m above ground",
     }, {
         "user_name": "v_component_wind_10m",
         "shortName": "10v", "typeOfLevel": "heightAboveGround", "level": 10,
+        "idx": "VGRD:10 m above ground",
     }, {
         "user_name": "u_component_wind_80m",
         "shortName": "u", "typeOfLevel": "heightAboveGround", "level": 80,
+        "idx": "UGRD:80 m above ground",
     }, {
         "user_name": "v_component_wind_80m",
         "shortName": "v", "typeOfLevel": "heightAboveGround", "level": 80,
+        "idx": "VGRD:80 m above ground",
     },
-]
+])
+
+# Built once at import for O(1) variable lookups by user_name
+TARGET_VARIABLES_BY_NAME = MappingProxyType({v["user_name"]: v for v in TARGET_VARIABLES})
+ALL_VARIABLE_NAMES = frozenset(TARGET_VARIABLES_BY_NAME)
 
-USER_TARGET_POINTS = [
+USER_TARGET_POINTS = (
     # (Latitude, Longitude)
     (31.006900, -88.010300),
     (31.756900, -106.375000),
@@ -60,4 +91,4 @@ USER_TARGET_POINTS = [
     (33.458665, -87.356820),
     (33.784500, -86.052400),
     (55.339722, -160.497200),
-]
\ No newline at end of file
+)
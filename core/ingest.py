@@ -1,78 +1,152 @@
 # Copyright (C) 2025 Aakash Shankar
 
+import hashlib
+import io
 import math
 import os
+import shutil
 import sys
-import tempfile
-from datetime import timedelta, datetime, timezone
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta, datetime
 
 import boto3
 import duckdb
 import eccodes
 import numpy as np
+import pyarrow as pa
+from boto3.s3.transfer import TransferConfig
 from botocore import UNSIGNED
 from botocore.config import Config
-from botocore.exceptions import ClientError
-from scipy.spatial import KDTree
+from botocore.exceptions import BotoCoreError, ClientError
 
-from .utils import latlon_to_xyz
+from .utils import latlon_to_xyz, split_grib_messages, grib_message_length
 
+# Column layout of extracted batches; matches the DuckDB table (FLOAT is float32) so inserts can SELECT * from a batch
+BATCH_SCHEMA = pa.schema([
+    ('valid_time_utc', pa.timestamp('us')),
+    ('run_time_utc', pa.timestamp('us')),
+    ('latitude', pa.float32()),
+    ('longitude', pa.float32()),
+    ('variable', pa.string()),
+    ('value', pa.float32()),
+    ('source_s3', pa.dictionary(pa.int32(), pa.string())), # One distinct path per file; DuckDB stores it as VARCHAR
+])
 
-def _get_grid_details(temp_filepath, target_points_xyz, grid_cache):
+# Whole-file downloads (no .idx sidecar) are split into parallel ranged parts above 8 MiB
+_TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=4, io_chunksize=1024 * 1024)
+
+# Target variable fields that are not GRIB keys and so take no part in message matching
+_NON_GRIB_KEYS = frozenset(("user_name", "idx"))
+
+
+# Up to this many targets a brute-force matrix product beats building a KDTree over the whole grid
+_BRUTE_FORCE_MAX_TARGETS = 16
+_BRUTE_FORCE_BLOCK_ROWS = 1 << 16 # Grid points converted and compared per block; keeps the block's XYZ and similarities in cache
+
+
+def _nearest_grid_indices(grid_lats, grid_lons, target_points_xyz):
     """
-    Reads grid definition from a GRIB file, checks cache, calculates
+    Finds the index of the nearest grid point to each target point. Both are
+    unit vectors on the sphere, so the nearest point is the one with the
+    largest dot product.
+
+    Small target sets are matched by brute force in one fused pass: each block
+    of grid points is converted to XYZ and compared against every target
+    through a BLAS matrix product, so the full (N, 3) grid array is never
+    built. Larger sets use a cKDTree.
+
+    Args:
+        grid_lats: Flattened NumPy array of grid latitudes.
+        grid_lons: Flattened NumPy array of grid longitudes.
+        target_points_xyz: (M, 3) float64 array of target points in XYZ coordinates.
+
+    Returns:
+        np.array: (M,) indices into the flattened grid.
+    """
+    num_targets = len(target_points_xyz)
+    if num_targets > _BRUTE_FORCE_MAX_TARGETS:
+        grid_xyz = latlon_to_xyz(grid_lats, grid_lons)
+        from scipy.spatial import cKDTree # Deferred: cached runs never build a tree, and scipy is slow to import
+        # Unbalanced, non-compact build with larger leaves is the fastest cKDTree construction; the query runs on all cores
+        kdtree = cKDTree(grid_xyz, leafsize=32, balanced_tree=False, compact_nodes=False)
+        return kdtree.query(target_points_xyz, k=1, workers=-1)[1]
+
+    best_sim = np.full(num_targets, -np.inf)
+    best_idx = np.zeros(num_targets, dtype=np.intp)
+    if num_targets == 0:
+        return best_idx
+    targets_t = np.ascontiguousarray(target_points_xyz.T)
+    sims = np.empty((_BRUTE_FORCE_BLOCK_ROWS, num_targets))
+    target_cols = np.arange(num_targets)
+    for start in range(0, len(grid_lats), _BRUTE_FORCE_BLOCK_ROWS):
+        stop = start + _BRUTE_FORCE_BLOCK_ROWS
+        block_xyz = latlon_to_xyz(grid_lats[start:stop], grid_lons[start:stop])
+        block_sims = np.matmul(block_xyz, targets_t, out=sims[:len(block_xyz)])
+        block_idx = block_sims.argmax(axis=0)
+        block_best = block_sims[block_idx, target_cols]
+        better = block_best > best_sim
+        best_sim[better] = block_best[better]
+        best_idx[better] = block_idx[better] + start
+    return best_idx
+
+
+def _get_grid_details(first_message, target_points_xyz, grid_cache, grid_cache_lock):
+    """
+    Reads grid definition from a GRIB message, checks cache, calculates
     nearest indices if needed, and updates the cache.
 
     Args:
-        temp_filepath: Path to the local temporary GRIB file.
+        first_message: Bytes-like buffer holding the file's first GRIB message.
         target_points_xyz: NumPy array of target points in XYZ coordinates.
         grid_cache: Dictionary holding cached grid information (mutated).
+        grid_cache_lock: Lock guarding grid_cache, shared by all worker threads.
 
     Returns:
-        A tuple: (success_flag, nearest_indices, lats_flat, lons_flat)
+        A tuple: (success_flag, nearest_indices, point_lats, point_lons, num_grid_points)
         success_flag (bool): True if grid details were successfully obtained/calculated.
         nearest_indices (np.array or None): Indices of nearest grid points.
-        lats_flat (np.array or None): Flattened latitudes of the grid.
-        lons_flat (np.array or None): Flattened longitudes (adjusted) of the grid.
+        point_lats (np.array or None): Latitude of the nearest grid point to each target.
+        point_lons (np.array or None): Longitude (adjusted) of the nearest grid point to each target.
+        num_grid_points (int or None): Number of points in the grid.
     """
     gid_peek = None
     grid_calc_success = False
-    nearest_indices = None
-    cached_lats = None
-    cached_lons = None
 
     try:
-        print(f"  Peeking into temporary file for grid info: {temp_filepath}")
-        with open(temp_filepath, 'rb') as peek_f:
-            gid_peek = eccodes.codes_grib_new_from_file(peek_f)
-            if not gid_peek:
-                print(f"  Warning: Could not read first GRIB message to determine grid.", file=sys.stderr)
-                return False, None, None, None # Indicate failure
-
-            grid_ni = eccodes.codes_get_long(gid_peek, "Ni")
-            grid_nj = eccodes.codes_get_long(gid_peek, "Nj")
-            grid_lat1 = eccodes.codes_get_double(gid_peek, "latitudeOfFirstGridPointInDegrees")
-            grid_lon1 = eccodes.codes_get_double(gid_peek, "longitudeOfFirstGridPointInDegrees")
-            grid_dt = eccodes.codes_get_long(gid_peek, "gridDefinitionTemplateNumber")
-            current_file_grid_id = f"{grid_dt}-{grid_ni}-{grid_nj}-{grid_lat1:.4f}-{grid_lon1:.4f}"
-            print(f"  File Grid ID: {current_file_grid_id}")
-
+        gid_peek = eccodes.codes_new_from_message(first_message)
+        if not gid_peek:
+            print(f"  Warning: Could not read first GRIB message to determine grid.", file=sys.stderr)
+            return False, None, None, None, None # Indicate failure
+
+        grid_ni = eccodes.codes_get_long(gid_peek, "Ni")
+        grid_nj = eccodes.codes_get_long(gid_peek, "Nj")
+        grid_lat1 = eccodes.codes_get_double(gid_peek, "latitudeOfFirstGridPointInDegrees")
+        grid_lon1 = eccodes.codes_get_double(gid_peek, "longitudeOfFirstGridPointInDegrees")
+        grid_dt = eccodes.codes_get_long(gid_peek, "gridDefinitionTemplateNumber")
+        current_file_grid_id = f"{grid_dt}-{grid_ni}-{grid_nj}-{grid_lat1:.4f}-{grid_lon1:.4f}"
+        print(f"  File Grid ID: {current_file_grid_id}")
+
+        # Held for the whole miss path so concurrent workers build each grid's KDTree only once
+        with grid_cache_lock:
             if current_file_grid_id not in grid_cache:
                 print(f"  Grid not in cache. Calculating nearest points...")
                 grid_lats_arr = eccodes.codes_get_array(gid_peek, 'latitudes')
                 grid_lons_arr = eccodes.codes_get_array(gid_peek, 'longitudes')
 
                 if 0 < grid_lats_arr.size == grid_lons_arr.size:
-                    grid_lats_flat = grid_lats_arr.flatten()
-                    grid_lons_flat = grid_lons_arr.flatten()
-                    grid_lons_flat[grid_lons_flat > 180] -= 360 # Adjust longitude
-                    grid_xyz = np.array(latlon_to_xyz(grid_lats_flat, grid_lons_flat)).T
-                    kdtree = KDTree(grid_xyz)
-                    distances, indices = kdtree.query(target_points_xyz, k=1)
+                    grid_lats_flat = grid_lats_arr.ravel()
+                    grid_lons_flat = grid_lons_arr.ravel()
+                    # XYZ is periodic in longitude, so the search takes eccodes' 0-360 values as-is
+                    indices = _nearest_grid_indices(grid_lats_flat, grid_lons_flat, target_points_xyz)
+                    pt_lons = grid_lons_flat[indices]
+                    pt_lons[pt_lons > 180] -= 360 # Adjust longitude, only for the selected points
+                    # Only the target points' coordinates are kept; the full grid arrays are dropped after the query
                     grid_cache[current_file_grid_id] = {
-                        'lats': grid_lats_flat,
-                        'lons': grid_lons_flat,
-                        'indices': indices
+                        'pt_lats': grid_lats_flat[indices].astype(np.float32),
+                        'pt_lons': pt_lons.astype(np.float32),
+                        'indices': indices.astype(np.int32), # Halves the index bytes np.take reads per message
+                        'num_points': np.array(grid_lats_flat.size)
                     }
                     print(f"  Calculated and cached nearest points.")
                     grid_calc_success = True
@@ -83,19 +157,18 @@ def _get_grid_details(temp_filepath, target_points_xyz, grid_cache):
                 print(f"  Grid found in cache.")
                 grid_calc_success = True
 
-            if grid_calc_success and current_file_grid_id in grid_cache:
-                cached_grid = grid_cache[current_file_grid_id]
-                nearest_indices = cached_grid['indices']
-                cached_lats = cached_grid['lats']
-                cached_lons = cached_grid['lons']
-                return True, nearest_indices, cached_lats, cached_lons
-            else:
-                print(f"  Warning: Could not get/calculate nearest indices for grid {current_file_grid_id}.", file=sys.stderr)
-                return False, None, None, None # Indicate failure
+            cached_grid = grid_cache.get(current_file_grid_id)
+
+        if grid_calc_success and cached_grid is not None:
+            return (True, cached_grid['indices'], cached_grid['pt_lats'], cached_grid['pt_lons'],
+                    int(cached_grid['num_points']))
+        else:
+            print(f"  Warning: Could not get/calculate nearest indices for grid {current_file_grid_id}.", file=sys.stderr)
+            return False, None, None, None, None # Indicate failure
 
     except Exception as peek_err:
         print(f"  Error during grid calculation/peek: {peek_err}", file=sys.stderr)
-        return False, None, None, None # Indicate failure
+        return False, None, None, None, None # Indicate failure
     finally:
         if gid_peek:
             try:
@@ -103,166 +176,389 @@ def _get_grid_details(temp_filepath, target_points_xyz, grid_cache):
             except Exception as exc:
                print(f"  Warning: Encountered exception releasing peek gid: {exc}", file=sys.stderr)
 
-def _extract_data_from_messages(temp_filepath, nearest_indices, grid_lats, grid_lons, target_variables, s3_source_path):
+# Typed getters resolved once per target key rather than dispatched on every message
+_GETTERS_BY_TYPE = {str: eccodes.codes_get_string, int: eccodes.codes_get_long, float: eccodes.codes_get_double}
+
+
+def _build_target_matcher(target_variables):
+    """
+    Indexes target variables by the GRIB key values that identify them, so a
+    message can be matched with one fetch per distinct key and a dict lookup.
+
+    Returns:
+        A tuple: (match_keys, groups)
+        match_keys (dict): Every GRIB key any target constrains -> eccodes getter for its expected value's type.
+        groups (list): (keys, lookup) pairs, one per distinct key set, where lookup maps the tuple
+            of expected values for those keys to a list of (config order, user_name).
+    """
+    match_keys = {}
+    groups = {}
+    for order, target in enumerate(target_variables):
+        criteria = {key: val for key, val in target.items() if key not in _NON_GRIB_KEYS}
+        for key, val in criteria.items():
+            match_keys.setdefault(key, _GETTERS_BY_TYPE.get(type(val), eccodes.codes_get))
+        keys = tuple(sorted(criteria))
+        lookup = groups.setdefault(keys, {})
+        lookup.setdefault(tuple(criteria[k] for k in keys), []).append((order, target["user_name"]))
+    return match_keys, list(groups.items())
+
+
+def _match_targets(gid, match_keys, groups):
+    """Returns the user_names of all targets matching the message, in config order (empty if none)."""
+    msg_vals = {}
+    for key, get in match_keys.items():
+        try:
+            msg_vals[key] = get(gid, key)
+        except (eccodes.KeyValueNotFoundError, eccodes.WrongTypeError, eccodes.EncodingError): # Key absent from this message
+            continue
+
+    matches = []
+    for keys, lookup in groups:
+        if all(k in msg_vals for k in keys):
+            matches.extend(lookup.get(tuple(msg_vals[k] for k in keys), ()))
+    return [user_name for _, user_name in sorted(matches)]
+
+
+def _grib_run_time(date_val, time_val):
+    """
+    Converts GRIB 'date' (YYYYMMDD) and 'time' (HHMM) integers to a naive UTC
+    datetime64[us] with integer arithmetic, avoiding strptime on every message.
+    """
+    year, month, day = date_val // 10000, date_val // 100 % 100, date_val % 100
+    hour, minute = time_val // 100, time_val % 100
+    month_start = np.datetime64(year - 1970, 'Y').astype('datetime64[M]') + (month - 1)
+    return (month_start.astype('datetime64[D]') + (day - 1)).astype('datetime64[us]') + np.timedelta64(hour * 60 + minute, 'm')
+
+
+def _extract_points(values_flat, nearest_indices, missing_value, point_vals, valid):
+    """
+    Gathers a message's values at the target points into the preallocated
+    point_vals buffer and flags usable entries in the preallocated valid mask.
+    eccodes reports bitmap-masked points as the message's missingValue rather
+    than NaN, so both are excluded.
+    """
+    np.take(values_flat, nearest_indices, out=point_vals)
+    np.isfinite(point_vals, out=valid)
+    valid &= point_vals != missing_value
+
+
+def _extract_data_from_messages(messages, nearest_indices, point_lats, point_lons, num_grid_points, target_variables, s3_source_path):
     """
     Iterates through GRIB messages in a file, matches target variables,
-    extracts data at specified points, and returns rows to insert.
+    extracts data at specified points, and returns them as a columnar batch.
 
     Args:
-        temp_filepath: Path to the local temporary GRIB file.
+        messages: List of bytes-like buffers, one per GRIB message in the file.
         nearest_indices: NumPy array of nearest grid point indices.
-        grid_lats: Flattened NumPy array of grid latitudes.
-        grid_lons: Flattened NumPy array of grid longitudes.
+        point_lats: NumPy array of the nearest grid point latitude for each target.
+        point_lons: NumPy array of the nearest grid point longitude for each target.
+        num_grid_points: Number of points in the grid, used to validate decoded values.
         target_variables: List of target variable dictionaries.
         s3_source_path: The S3 path string for this file.
 
     Returns:
-        A tuple: (rows_to_insert, messages_scanned, variables_found)
-        rows_to_insert (list): List of tuples, each representing a row for DB insertion.
+        A tuple: (batch, messages_scanned, variables_found)
+        batch (pa.Table): Extracted rows laid out as BATCH_SCHEMA (possibly empty).
         messages_scanned (int): Number of GRIB messages scanned in the file.
         variables_found (set): Set of 'user_name' strings for matched variables.
     """
-    rows_to_insert = []
     messages_scanned = 0
     variables_found = set()
+    num_points = len(nearest_indices)
+    # Reused by every matched message so the hot path allocates nothing beyond the column buffers
+    point_vals = np.empty(num_points, dtype=np.float64)
+    valid = np.empty(num_points, dtype=bool)
+    match_keys, target_groups = _build_target_matcher(target_variables)
+    matched = [] # (message number, gid, target_names) for messages whose values get decoded
 
     try:
-        with open(temp_filepath, 'rb') as local_f:
-            while True:
-                gid = None
-                try:
-                    gid = eccodes.codes_grib_new_from_file(local_f)
-                    if not gid: break # End of file
-
-                    messages_scanned += 1
-                    for target in target_variables:
-                        target_name = target["user_name"]
-                        matched = True
-                        for key, target_val in target.items():
-                            if "user_name" == key: continue
-                            if not eccodes.codes_is_defined(gid, key):
-                                matched = False; break
-                            try:
-                                if isinstance(target_val, str): msg_value = eccodes.codes_get_string(gid, key)
-                                elif isinstance(target_val, int): msg_value = eccodes.codes_get_long(gid, key)
-                                elif isinstance(target_val, float): msg_value = eccodes.codes_get_double(gid, key)
-                                else: msg_value = eccodes.codes_get(gid, key)
-                                if msg_value != target_val: matched = False; break
-                            except (eccodes.KeyValueNotFoundError, eccodes.WrongTypeError, eccodes.EncodingError):
-                                matched = False; break
-
-                        if matched:
-                            variables_found.add(target_name)
-                            try:
-                                values_flat = eccodes.codes_get_values(gid).flatten()
-                                if values_flat.size != grid_lats.size:
-                                    print(f"  Warning: Size mismatch for {target_name} msg {messages_scanned}.", file=sys.stderr)
-                                    continue
-
-                                date_val = eccodes.codes_get_long(gid, 'date')
-                                time_val = eccodes.codes_get_long(gid, 'time')
-                                step_val = eccodes.codes_get_long(gid, 'step')
-                                run_dt_utc = datetime.strptime(f"{date_val}{time_val:04d}", "%Y%m%d%H%M").replace(tzinfo=timezone.utc)
-                                valid_dt_utc = run_dt_utc + timedelta(hours=step_val)
-
-                                for i, flat_idx in enumerate(nearest_indices):
-                                    point_lat = grid_lats[flat_idx]
-                                    point_lon = grid_lons[flat_idx]
-                                    point_val = values_flat[flat_idx]
-                                    if np.isnan(point_val): # Or check against eccodes missing value if needed
-                                        print(f"    Skipping NaN value for {target_name} at index {flat_idx}") # Optional debug print
-                                        continue
-                                    row = (valid_dt_utc, run_dt_utc, point_lat, point_lon, target_name, point_val, s3_source_path)
-                                    rows_to_insert.append(row)
-
-                            except Exception as extract_err:
-                                print(f"  Error extracting data for {target_name} msg {messages_scanned}: {extract_err}", file=sys.stderr)
-                            break
-                finally:
-                    if gid: eccodes.codes_release(gid)
-
-    except FileNotFoundError:
-        print(f"Error: Temp file {temp_filepath} disappeared during message processing loop?", file=sys.stderr)
-        raise
+        # Pass 1: match on header keys only, so the column buffers can be sized before anything is decoded
+        for message in messages:
+            gid = eccodes.codes_new_from_message(message)
+            messages_scanned += 1
+            try:
+                target_names = _match_targets(gid, match_keys, target_groups)
+            except Exception:
+                eccodes.codes_release(gid)
+                raise
+            if target_names:
+                matched.append((messages_scanned, gid, target_names))
+                variables_found.update(target_names)
+            else:
+                eccodes.codes_release(gid)
+
+        # Upper bound on rows: every target point valid for every matched (message, target) pair
+        capacity = num_points * sum(len(target_names) for _, _, target_names in matched)
+        valid_time_col = np.empty(capacity, dtype='datetime64[us]')
+        run_time_col = np.empty(capacity, dtype='datetime64[us]')
+        lat_col = np.empty(capacity, dtype=np.float32)
+        lon_col = np.empty(capacity, dtype=np.float32)
+        variable_col = np.empty(capacity, dtype=object)
+        value_col = np.empty(capacity, dtype=np.float32) # Narrowed only after the float64 missing-value check
+        num_rows = 0
+
+        # Pass 2: decode each matched message once and write its rows for every matching target
+        for msg_num, gid, target_names in matched:
+            target_label = "/".join(target_names)
+            try:
+                values_flat = eccodes.codes_get_values(gid).ravel()
+                if values_flat.size != num_grid_points:
+                    print(f"  Warning: Size mismatch for {target_label} msg {msg_num}.", file=sys.stderr)
+                    continue
+
+                date_val = eccodes.codes_get_long(gid, 'date')
+                time_val = eccodes.codes_get_long(gid, 'time')
+                step_val = eccodes.codes_get_long(gid, 'step')
+                run_dt_utc = _grib_run_time(date_val, time_val)
+                valid_dt_utc = run_dt_utc + np.timedelta64(step_val, 'h')
+
+                missing_value = eccodes.codes_get_double(gid, 'missingValue')
+                _extract_points(values_flat, nearest_indices, missing_value, point_vals, valid)
+                num_valid = int(valid.sum())
+                if num_valid < valid.size:
+                    print(f"    Skipping {valid.size - num_valid} missing value(s) for {target_label}")
+                for target_name in target_names:
+                    end = num_rows + num_valid
+                    valid_time_col[num_rows:end] = valid_dt_utc
+                    run_time_col[num_rows:end] = run_dt_utc
+                    np.compress(valid, point_lats, out=lat_col[num_rows:end])
+                    np.compress(valid, point_lons, out=lon_col[num_rows:end])
+                    variable_col[num_rows:end] = target_name
+                    np.compress(valid, point_vals, out=value_col[num_rows:end])
+                    num_rows = end
+
+            except Exception as extract_err:
+                print(f"  Error extracting data for {target_label} msg {msg_num}: {extract_err}", file=sys.stderr)
+
     except Exception as proc_err:
-        print(f"Error during message processing loop for {temp_filepath}: {proc_err}", file=sys.stderr)
+        print(f"Error during message processing loop for {s3_source_path}: {proc_err}", file=sys.stderr)
         raise
+    finally:
+        for _, gid, _ in matched:
+            eccodes.codes_release(gid)
+
+    if num_rows:
+        batch = pa.table({
+            'valid_time_utc': valid_time_col[:num_rows],
+            'run_time_utc': run_time_col[:num_rows],
+            'latitude': lat_col[:num_rows],
+            'longitude': lon_col[:num_rows],
+            'variable': variable_col[:num_rows],
+            'value': value_col[:num_rows],
+            'source_s3': pa.DictionaryArray.from_arrays(np.zeros(num_rows, dtype=np.int32), [s3_source_path]),
+        }, schema=BATCH_SCHEMA)
+    else:
+        batch = BATCH_SCHEMA.empty_table()
+    return batch, messages_scanned, variables_found
+
+
+def _idx_byte_ranges(idx_text, idx_fields):
+    """
+    Finds the byte ranges of the wanted messages in a GRIB .idx sidecar.
+
+    Each sidecar line reads "msg_num:offset:d=YYYYMMDDHH:VAR:level:forecast:".
+    A message ends where the next distinct offset begins, or at end of file.
+    Adjacent wanted messages are coalesced so they come back in one request.
+
+    Args:
+        idx_text: Decoded contents of the .idx file.
+        idx_fields: Set of "VAR:level" strings to fetch.
+
+    Returns:
+        list: (start, end) byte ranges, end exclusive and None for end of file.
+    """
+    offsets = []
+    wanted = set()
+    for line in idx_text.splitlines():
+        fields = line.split(":")
+        if len(fields) < 5:
+            continue
+        offset = int(fields[1])
+        offsets.append(offset)
+        if f"{fields[3]}:{fields[4]}" in idx_fields:
+            wanted.add(offset)
+
+    ranges = []
+    starts = sorted(set(offsets))
+    for start, end in zip(starts, starts[1:] + [None]):
+        if start not in wanted:
+            continue
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
 
-    return rows_to_insert, messages_scanned, variables_found
 
+def _get_range(s3_client, s3_bucket, s3_key, byte_range):
+    start, end = byte_range
+    http_range = f"bytes={start}-{'' if end is None else end - 1}"
+    return s3_client.get_object(Bucket=s3_bucket, Key=s3_key, Range=http_range)['Body'].read()
 
-def process_grib_file(s3_client, s3_bucket, s3_key, target_points_xyz, target_variables, grid_cache, db_con, table_name):
+
+def _download_grib(s3_client, s3_bucket, s3_key, idx_fields, range_executor, buffer_slots):
     """
-    Downloads, processes a single GRIB2 file from S3, extracts target data,
-    and inserts it into the database. Updates grid_cache in place.
+    Reads the needed messages of a GRIB2 file from S3 into memory. Runs on the
+    prefetch pool so the next files download while earlier ones are being decoded.
+
+    When idx_fields is given and the file has an .idx sidecar, only the byte
+    ranges of matching messages are fetched, in parallel on range_executor.
+    Otherwise the whole file is downloaded.
+
+    A slot in buffer_slots is held for as long as the bytes are alive, which
+    bounds how many downloaded files sit in memory at once. process_grib_file
+    releases it once the file has been decoded.
 
     Args:
         s3_client: Initialized boto3 S3 client.
         s3_bucket: Name of the S3 bucket.
+        s3_key: The specific S3 key (file path) to download.
+        idx_fields: Set of "VAR:level" .idx selectors, or None to always download whole files.
+        range_executor: Executor for ranged GETs; must not be the pool running this function.
+        buffer_slots: Semaphore bounding the number of in-memory files.
+
+    Returns:
+        A tuple: (messages, num_bytes)
+        messages (list | None): memoryview slices, one per downloaded GRIB message,
+            or None if the .idx sidecar lists none of idx_fields and nothing was fetched.
+        num_bytes (int): Total bytes transferred for the GRIB data.
+    """
+    buffer_slots.acquire()
+    try:
+        byte_ranges = None
+        if idx_fields is not None:
+            try:
+                idx_text = s3_client.get_object(Bucket=s3_bucket, Key=s3_key + ".idx")['Body'].read().decode()
+                byte_ranges = _idx_byte_ranges(idx_text, idx_fields)
+            except ClientError as ce:
+                if ce.response['Error']['Code'] != 'NoSuchKey':
+                    raise
+                print(f"  No .idx sidecar for {s3_key}; downloading the whole file.")
+
+        if byte_ranges == []:
+            buffer_slots.release()
+            return None, 0
+
+        if byte_ranges is None:
+            whole_file = io.BytesIO()
+            s3_client.download_fileobj(s3_bucket, s3_key, whole_file, Config=_TRANSFER_CONFIG)
+            chunks = [whole_file.getbuffer()]
+        else:
+            chunks = list(range_executor.map(
+                lambda byte_range: _get_range(s3_client, s3_bucket, s3_key, byte_range), byte_ranges
+            ))
+
+        messages = []
+        for chunk in chunks:
+            messages.extend(split_grib_messages(chunk))
+        return messages, sum(len(chunk) for chunk in chunks)
+    except BaseException:
+        buffer_slots.release()
+        raise
+
+
+def _prime_grid_cache(s3_client, s3_bucket, s3_keys, target_points_xyz, grid_cache, grid_cache_lock):
+    """
+    Builds the grid_cache entry up front from the first message of the first
+    available file, fetched with two small ranged GETs (Section 0, then the
+    message), so the nearest-point search runs once before any worker starts
+    and does not depend on which file happens to download first.
+
+    Returns:
+        bool: True if the cache was primed.
+    """
+    for s3_key in s3_keys:
+        try:
+            header = _get_range(s3_client, s3_bucket, s3_key, (0, 16))
+            length = grib_message_length(header) if len(header) == 16 else None
+            if not length:
+                continue
+            first_message = _get_range(s3_client, s3_bucket, s3_key, (0, length))
+        except ClientError as ce:
+            if ce.response['Error']['Code'] in ('NoSuchKey', 'InvalidRange'):
+                continue
+            print(f"  Warning: Could not fetch grid from {s3_key}: {ce}", file=sys.stderr)
+            return False
+        except BotoCoreError as bce:
+            # Timeouts/connection errors: skip priming, workers build the cache lazily
+            print(f"  Warning: Could not fetch grid from {s3_key}: {bce}", file=sys.stderr)
+            return False
+        print(f"Priming grid cache from {s3_key}")
+        return _get_grid_details(first_message, target_points_xyz, grid_cache, grid_cache_lock)[0]
+    return False
+
+
+def process_grib_file(download, buffer_slots, s3_bucket, s3_key, target_points_xyz, target_variables, grid_cache, grid_cache_lock):
+    """
+    Processes a single GRIB2 file prefetched from S3, extracting target data
+    into rows for the caller to insert. Updates grid_cache in place.
+
+    Safe to run from worker threads: it never touches the database, and all
+    grid_cache access goes through grid_cache_lock.
+
+    Args:
+        download: Future resolving to the file's downloaded messages (see _download_grib).
+        buffer_slots: Semaphore released once the downloaded bytes are no longer needed.
+        s3_bucket: Name of the S3 bucket.
         s3_key: The specific S3 key (file path) to process.
         target_points_xyz: NumPy array of target points in XYZ coordinates.
         target_variables: List of target variable dictionaries (from config).
         grid_cache: Dictionary used for caching grid information (modified in place).
-        db_con: Active DuckDB database connection.
-        table_name: Name of the target table in DuckDB.
+        grid_cache_lock: Lock guarding grid_cache.
 
     Returns:
         A dictionary containing processing results for this file, e.g.:
         {
             "messages_scanned": int,
-            "rows_inserted": int,
+            "batch": pa.Table | None, # Extracted rows ready for insertion
             "status": "processed" | "skipped_no_grid" | "not_found" | "download_error" | "processing_error",
             "variables_found_in_file": set # Set of user_names found
         }
     """
     print(f"Attempting to process S3 file: s3://{s3_bucket}/{s3_key}")
-    temp_filepath = None
     messages_scanned_in_file = 0
-    rows_inserted_for_file = 0
+    batch = None
     variables_found_in_file = set()
+    downloaded = False
 
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as temp_f:
-            temp_filepath = temp_f.name
-        print(f"  Downloading temporary file to {temp_filepath}")
-        s3_client.download_file(s3_bucket, s3_key, temp_filepath)
-        print(f"  Download complete.")
-
-        grid_ok, nearest_indices, grid_lats, grid_lons = _get_grid_details(
-            temp_filepath, target_points_xyz, grid_cache
-        )
+        # Held in memory; eccodes decodes each message from its byte slice, so no temp file round-trip
+        messages, num_bytes = download.result()
+        if messages is None:
+            print(f"  No target variables listed in the .idx for {s3_key}; nothing to extract.")
+            return {"messages_scanned": 0, "batch": None, "status": "processed", "variables_found_in_file": set()}
+        downloaded = True
+        print(f"  Download complete ({num_bytes} bytes, {len(messages)} messages).")
+
+        if messages:
+            grid_ok, nearest_indices, point_lats, point_lons, num_grid_points = _get_grid_details(
+                messages[0], target_points_xyz, grid_cache, grid_cache_lock
+            )
+        else:
+            print(f"  Warning: No GRIB messages found in {s3_key}.", file=sys.stderr)
+            grid_ok = False
 
         if grid_ok:
             s3_source_path = f"s3://{s3_bucket}/{s3_key}"  # Define source path once
             try:
-                rows_to_insert, messages_scanned_in_file, variables_found_in_file = _extract_data_from_messages(
-                    temp_filepath=temp_filepath,
+                batch, messages_scanned_in_file, variables_found_in_file = _extract_data_from_messages(
+                    messages=messages,
                     nearest_indices=nearest_indices,
-                    grid_lats=grid_lats,
-                    grid_lons=grid_lons,
+                    point_lats=point_lats,
+                    point_lons=point_lons,
+                    num_grid_points=num_grid_points,
                     target_variables=target_variables,
                     s3_source_path=s3_source_path
                 )
 
-                if rows_to_insert:
-                    print(f"  Inserting {len(rows_to_insert)} rows into DuckDB for file {s3_key}")
-                    try:
-                        db_con.executemany(
-                            f"INSERT INTO {table_name} VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
-                            rows_to_insert)
-                        rows_inserted_for_file = len(rows_to_insert)
-                        print(
-                            f"  Attempted insert of {rows_inserted_for_file} rows complete. Scanned {messages_scanned_in_file} messages.")
-                        file_status = "processed"
-                    except Exception as dberr:
-                        print(f"  Error inserting batch of {len(rows_to_insert)} into DuckDB: {dberr}", file=sys.stderr)
-                        file_status = "processing_error"
+                if batch.num_rows:
+                    print(f"  Extracted {batch.num_rows} rows from {s3_key}. Scanned {messages_scanned_in_file} messages.")
                 else:
                     print(
                         f"  No matching data found or extracted for target points in {s3_key}. Scanned {messages_scanned_in_file} messages.")
-                    file_status = "processed"
+                file_status = "processed"
 
-            except (FileNotFoundError, Exception) as proc_err:
+            except Exception as proc_err:
                 print(f"  Error during message extraction phase for {s3_key}: {proc_err}", file=sys.stderr)
                 file_status = "processing_error"
 
@@ -272,31 +568,137 @@ def process_grib_file(s3_client, s3_bucket, s3_key, target_points_xyz, target_va
 
         return {
             "messages_scanned": messages_scanned_in_file,
-            "rows_inserted": rows_inserted_for_file,
+            "batch": batch,
             "status": file_status,
             "variables_found_in_file": variables_found_in_file
         }
 
     except ClientError as ce:
-        if ce.response['Error']['Code'] == 'NoSuchKey':
+        if ce.response['Error']['Code'] in ('NoSuchKey', '404'): # download_fileobj reports a missing key from its HEAD
             print(f"  Warning: File not found on S3: s3://{s3_bucket}/{s3_key}")
-            return {"messages_scanned": 0, "rows_inserted": 0, "status": "not_found", "variables_found_in_file": set()}
+            return {"messages_scanned": 0, "batch": None, "status": "not_found", "variables_found_in_file": set()}
         else:
             print(f"  Error accessing S3 file {s3_key}: {ce}", file=sys.stderr)
-            return {"messages_scanned": 0, "rows_inserted": 0, "status": "download_error", "variables_found_in_file": set()}
+            return {"messages_scanned": 0, "batch": None, "status": "download_error", "variables_found_in_file": set()}
     except Exception as e:
         print(f"  Unhandled error during processing of {s3_key}: {e}", file=sys.stderr)
-        return {"messages_scanned": messages_scanned_in_file, "rows_inserted": rows_inserted_for_file, "status": "processing_error", "variables_found_in_file": variables_found_in_file}
+        return {"messages_scanned": messages_scanned_in_file, "batch": None, "status": "processing_error", "variables_found_in_file": variables_found_in_file}
     finally:
-        if temp_filepath and os.path.exists(temp_filepath):
+        if downloaded:
+            buffer_slots.release()
+
+_GRID_CACHE_ARRAYS = ('pt_lats', 'pt_lons', 'indices', 'num_points')
+
+
+def _grid_cache_path(cache_dir, grid_id, points_hash):
+    return os.path.join(cache_dir, f"{grid_id}_{points_hash}")
+
+
+def _load_grid_cache(cache_dir, points_hash):
+    """
+    Loads grid_cache entries persisted by earlier runs for the same set of
+    target points. Arrays are memory-mapped read-only, so concurrent runs
+    share the same page cache.
+
+    Returns:
+        dict: grid_id -> {'pt_lats', 'pt_lons', 'indices', 'num_points'}, empty if nothing is cached.
+    """
+    grid_cache = {}
+    if not os.path.isdir(cache_dir):
+        return grid_cache
+    suffix = f"_{points_hash}"
+    for entry in os.listdir(cache_dir):
+        if not entry.endswith(suffix):
+            continue
+        grid_id = entry[:-len(suffix)]
+        try:
+            grid_cache[grid_id] = {
+                name: np.load(os.path.join(cache_dir, entry, f"{name}.npy"), mmap_mode='r')
+                for name in _GRID_CACHE_ARRAYS
+            }
+            print(f"Loaded cached grid {grid_id} from {cache_dir}")
+        except Exception as exc:
+            # Dropped so the entry is rebuilt and saved again (e.g. one written by an older version)
+            print(f"Warning: Discarding unreadable grid cache entry {entry}: {exc}", file=sys.stderr)
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+    return grid_cache
+
+
+def _save_grid_cache(cache_dir, points_hash, grid_cache):
+    """Persists grid_cache entries that are not already on disk, one .npy file per array."""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for grid_id, cached_grid in grid_cache.items():
+            path = _grid_cache_path(cache_dir, grid_id, points_hash)
+            if os.path.exists(path):
+                continue
+            # Write then rename so a concurrent run never maps a partial entry
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            os.makedirs(tmp_path, exist_ok=True)
+            for name in _GRID_CACHE_ARRAYS:
+                np.save(os.path.join(tmp_path, f"{name}.npy"), cached_grid[name])
             try:
-                print(f"  Cleaning up temporary file: {temp_filepath}")  # Optional debug print
-                os.remove(temp_filepath)
-            except OSError as ose:
-                print(f"  Warning: Could not delete temporary file {temp_filepath}: {ose}", file=sys.stderr)
+                os.rename(tmp_path, path)
+            except OSError: # Another run saved the same entry first
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                continue
+            print(f"Saved grid {grid_id} to cache at {path}")
+    except OSError as ose:
+        print(f"Warning: Could not persist grid cache to {cache_dir}: {ose}", file=sys.stderr)
+
+
+def _insert_batches(db_con, table_name, batches, first_seq):
+    """
+    Bulk-appends extracted batches to the staging table by registering them as
+    one Arrow table. Must only be called from the thread that owns db_con.
+
+    Rows are numbered from first_seq in a staged_seq column, recording the
+    order they were extracted in for _merge_staging.
+
+    Returns:
+        int or None: Number of rows submitted, or None if the insert failed.
+    """
+    batch = pa.concat_tables(batches)
+    batch = batch.append_column('staged_seq', pa.array(np.arange(first_seq, first_seq + batch.num_rows)))
+    print(f"  Inserting {batch.num_rows} rows from {len(batches)} file(s) into DuckDB")
+    try:
+        db_con.register('tmp_batch', batch)
+        db_con.execute(f"INSERT INTO {table_name} SELECT * FROM tmp_batch")
+        print(f"  Attempted insert of {batch.num_rows} rows complete.")
+        return batch.num_rows
+    except Exception as dberr:
+        print(f"  Error inserting batch of {batch.num_rows} into DuckDB: {dberr}", file=sys.stderr)
+        return None
+    finally:
+        db_con.unregister('tmp_batch')
+
+
+def _merge_staging(db_con, table_name, staging_table):
+    """
+    Moves the run's staged rows into table_name in one statement, so primary
+    key checks happen once for the whole run instead of on every flush. Rows
+    repeating a key within the run are collapsed to the first one staged, as
+    if they had been inserted in order; keys already in the table are skipped.
 
-def ingest(run_date, num_hours, cycle, file_type, f_start, f_end, target_vars, target_points, db_filename, table_name, s3_bucket):
+    Returns:
+        int or None: Number of new rows inserted, or None if the merge failed.
+    """
+    try:
+        return db_con.execute(f"""
+            INSERT INTO {table_name}
+            SELECT DISTINCT ON (valid_time_utc, run_time_utc, latitude, longitude, variable) * EXCLUDE (staged_seq)
+            FROM {staging_table}
+            ORDER BY staged_seq
+            ON CONFLICT DO NOTHING
+            """).fetchone()[0]
+    except duckdb.Error as dberr:
+        print(f"  Error merging staged rows into {table_name}: {dberr}", file=sys.stderr)
+        return None
+
+
+def ingest(run_date, num_hours, cycle, file_type, f_start, f_end, target_vars, target_points, db_filename, table_name, s3_bucket, max_workers=8, grid_cache_dir=None, insert_batch_size=50000, prefetch_files=4, range_fetches=16, duckdb_threads=None, duckdb_memory_limit=None):
     total_rows_attempted_insert = 0
+    total_rows_inserted = 0
     total_messages_scanned = 0
     files_successfully_downloaded = 0
     files_processed_ok = 0
@@ -307,11 +709,19 @@ def ingest(run_date, num_hours, cycle, file_type, f_start, f_end, target_vars, t
     targets_found = set()
     s3_keys_to_process = []
     grid_cache = {}
+    grid_cache_lock = threading.Lock()
+    points_hash = None
+    pending_batches = []
+    pending_rows = 0
+    staged_seq = 0
     con = None
 
     try:
         print(f"Connecting to DuckDB database: {db_filename}")
-        con = duckdb.connect(database=db_filename, read_only=False)
+        db_config = {'preserve_insertion_order': False} # Row order is irrelevant here; lets bulk inserts stream
+        if duckdb_threads: db_config['threads'] = duckdb_threads
+        if duckdb_memory_limit: db_config['memory_limit'] = duckdb_memory_limit
+        con = duckdb.connect(database=db_filename, read_only=False, config=db_config)
         print(f"Creating table {table_name} with idempotence")
         create_table_sql = f"""
                 CREATE TABLE IF NOT EXISTS {table_name} (
@@ -326,10 +736,14 @@ def ingest(run_date, num_hours, cycle, file_type, f_start, f_end, target_vars, t
                 );
                 """
         con.execute(create_table_sql)
+        # Flushes land in a constraint-free temp table; the primary key is checked once, when it's merged in
+        staging_table = f"{table_name}_staging"
+        con.execute(f"CREATE OR REPLACE TEMP TABLE {staging_table} AS SELECT *, 0::BIGINT AS staged_seq FROM {table_name} LIMIT 0")
         print(f"Table creation complete.")
 
         print("Initializing S3 client for unsigned access...")
-        s3_client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
+        # boto3 clients are thread-safe; size the connection pool so workers don't queue for sockets
+        s3_client = boto3.client('s3', config=Config(signature_version=UNSIGNED, max_pool_connections=prefetch_files * _TRANSFER_CONFIG.max_concurrency + range_fetches))
         print(f"Targeting S3 Bucket: {s3_bucket}")
 
         print(f"Generating file list for {num_hours} hours back from RUN_DATE={run_date}, CYCLE={cycle}Z, TYPE={file_type}, F{f_start:02d}-F{f_end:02d}...")
@@ -361,36 +775,125 @@ def ingest(run_date, num_hours, cycle, file_type, f_start, f_end, target_vars, t
              print("Warning: No S3 keys were generated to process. Check configuration.", file=sys.stderr)
              sys.exit(0)
 
-        target_points_xyz = np.array([latlon_to_xyz(lat, lon) for lat, lon in target_points])
-
-        for s3_key in s3_keys_to_process:
-            result = process_grib_file(
-                s3_client=s3_client,
-                s3_bucket=s3_bucket,
-                s3_key=s3_key,
-                target_points_xyz=target_points_xyz,
-                target_variables=target_vars,
-                grid_cache=grid_cache,
-                db_con=con,
-                table_name=table_name
-            )
-            total_messages_scanned += result["messages_scanned"]
-            total_rows_attempted_insert += result["rows_inserted"]
-            targets_found.update(result["variables_found_in_file"])
-
-            if result["status"] == "processed":
-                files_successfully_downloaded += 1
-                files_processed_ok += 1
-            elif result["status"] == "skipped_no_grid":
-                files_successfully_downloaded += 1
-                files_skipped_no_grid += 1
-            elif result["status"] == "not_found":
-                files_not_found += 1
-            elif result["status"] == "download_error":
-                 files_with_download_errors += 1
-            elif result["status"] == "processing_error":
-                 files_successfully_downloaded += 1
-                 files_with_processing_errors += 1
+        target_latlon = np.asarray(target_points, dtype=np.float64).reshape(-1, 2)
+        target_points_xyz = latlon_to_xyz(target_latlon[:, 0], target_latlon[:, 1])
+
+        # Nearest indices depend on both the grid and the target points, so persisted entries are keyed on both
+        if grid_cache_dir:
+            points_hash = hashlib.sha1(target_points_xyz.tobytes()).hexdigest()
+            grid_cache.update(_load_grid_cache(grid_cache_dir, points_hash))
+
+        # Cold runs build the grid once here; runs with a persisted cache skip the extra fetch
+        if not grid_cache:
+            _prime_grid_cache(s3_client, s3_bucket, s3_keys_to_process, target_points_xyz, grid_cache, grid_cache_lock)
+
+        # Fetch only the messages named in each file's .idx sidecar, unless some target can't be selected that way
+        if all("idx" in target for target in target_vars):
+            idx_fields = frozenset(target["idx"] for target in target_vars)
+        else:
+            idx_fields = None
+            print("Warning: Not all target variables define an .idx selector; downloading whole files.", file=sys.stderr)
+
+        # Downloads run ahead of decoding on their own pool so network latency hides behind eccodes work.
+        # The semaphore caps files held in memory: one per decode worker plus prefetch_files queued ahead.
+        # DuckDB inserts stay on this thread since the connection isn't thread-safe.
+        print(f"Processing files with {max_workers} decode threads and {prefetch_files} download threads...")
+        buffer_slots = threading.BoundedSemaphore(max_workers + prefetch_files)
+        with ThreadPoolExecutor(max_workers=prefetch_files) as downloader, \
+                ThreadPoolExecutor(max_workers=range_fetches) as range_executor, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    process_grib_file,
+                    download=downloader.submit(
+                        _download_grib, s3_client, s3_bucket, s3_key, idx_fields, range_executor, buffer_slots
+                    ),
+                    buffer_slots=buffer_slots,
+                    s3_bucket=s3_bucket,
+                    s3_key=s3_key,
+                    target_points_xyz=target_points_xyz,
+                    target_variables=target_vars,
+                    grid_cache=grid_cache,
+                    grid_cache_lock=grid_cache_lock
+                ): s3_key
+                for s3_key in s3_keys_to_process
+            }
+            # On Ctrl-C or any escaping error, drop queued downloads/decodes instead of letting
+            # the executors' exit drain the whole backlog before the exception surfaces.
+            try:
+                # Batches from several files are accumulated and flushed together to amortize per-insert overhead.
+                # All flushes share one transaction so DuckDB commits once per run rather than once per insert.
+                uncommitted_files = 0
+                uncommitted_rows = 0
+                con.execute("BEGIN TRANSACTION")
+                for num_done, future in enumerate(as_completed(futures), 1):
+                    result = future.result()
+                    if result["batch"] is not None and result["batch"].num_rows:
+                        pending_batches.append(result["batch"])
+                        pending_rows += result["batch"].num_rows
+                    total_messages_scanned += result["messages_scanned"]
+                    targets_found.update(result["variables_found_in_file"])
+
+                    if result["status"] == "processed":
+                        files_successfully_downloaded += 1
+                        files_processed_ok += 1
+                    elif result["status"] == "skipped_no_grid":
+                        files_successfully_downloaded += 1
+                        files_skipped_no_grid += 1
+                    elif result["status"] == "not_found":
+                        files_not_found += 1
+                    elif result["status"] == "download_error":
+                         files_with_download_errors += 1
+                    elif result["status"] == "processing_error":
+                         files_successfully_downloaded += 1
+                         files_with_processing_errors += 1
+
+                    if pending_batches and (pending_rows >= insert_batch_size or num_done == len(futures)):
+                        rows_inserted = _insert_batches(con, staging_table, pending_batches, staged_seq)
+                        staged_seq += pending_rows
+                        if rows_inserted is None:
+                            # A failed statement aborts the transaction, taking earlier uncommitted flushes with it
+                            con.execute("ROLLBACK")
+                            con.execute("BEGIN TRANSACTION")
+                            lost_files = uncommitted_files + len(pending_batches)
+                            print(f"  Rolled back {uncommitted_rows} uncommitted rows from {lost_files} file(s).", file=sys.stderr)
+                            files_processed_ok -= lost_files
+                            files_with_processing_errors += lost_files
+                            total_rows_attempted_insert -= uncommitted_rows
+                            uncommitted_files = 0
+                            uncommitted_rows = 0
+                        else:
+                            total_rows_attempted_insert += rows_inserted
+                            uncommitted_files += len(pending_batches)
+                            uncommitted_rows += rows_inserted
+                        pending_batches = []
+                        pending_rows = 0
+
+                rows_merged = _merge_staging(con, table_name, staging_table) if uncommitted_rows else 0
+                if rows_merged is None:
+                    con.execute("ROLLBACK")
+                    print(f"  Rolled back {uncommitted_rows} uncommitted rows from {uncommitted_files} file(s).", file=sys.stderr)
+                    files_processed_ok -= uncommitted_files
+                    files_with_processing_errors += uncommitted_files
+                    total_rows_attempted_insert -= uncommitted_rows
+                else:
+                    con.execute("COMMIT")
+                    total_rows_inserted = rows_merged
+                    print(f"Merged {rows_merged} new rows into {table_name}.")
+            except BaseException:
+                for pool in (executor, downloader, range_executor):
+                    pool.shutdown(wait=False, cancel_futures=True)
+                # Keep the rows of files that already finished instead of losing the whole run to the rollback
+                try:
+                    if pending_batches and _insert_batches(con, staging_table, pending_batches, staged_seq) is not None:
+                        uncommitted_rows += pending_rows
+                    rows_merged = _merge_staging(con, table_name, staging_table) if uncommitted_rows else 0
+                    if rows_merged is not None:
+                        con.execute("COMMIT")
+                        print(f"Stopped early; merged {rows_merged} new rows from finished files into {table_name}.", file=sys.stderr)
+                except duckdb.Error as dberr:
+                    print(f"  Could not save rows from finished files: {dberr}", file=sys.stderr)
+                raise
 
     except duckdb.Error as dberr:
          print(f"A DuckDB error occurred outside file processing loop: {dberr}", file=sys.stderr)
@@ -400,6 +903,8 @@ def ingest(run_date, num_hours, cycle, file_type, f_start, f_end, target_vars, t
         if con:
             print(f"Closing DuckDB connection")
             con.close()
+        if points_hash is not None:
+            _save_grid_cache(grid_cache_dir, points_hash, grid_cache)
 
     print("\n" + "=" * 40)
     print("          Processing Summary")
@@ -412,7 +917,7 @@ def ingest(run_date, num_hours, cycle, file_type, f_start, f_end, target_vars, t
     if files_with_processing_errors > 0: print(f"Files downloaded but failed during processing: {files_with_processing_errors}")
     print(f"Total GRIB messages scanned across all processed files: {total_messages_scanned}")
     print(f"\nTotal rows prepared for insertion into '{table_name}': {total_rows_attempted_insert}")
-    print(f"(Actual rows inserted depends on conflicts 'ON CONFLICT DO NOTHING')")
+    print(f"New rows inserted (duplicates and existing keys skipped): {total_rows_inserted}")
     print(f"\nTarget variable types found across all files ({len(targets_found)} out of {len(target_vars)} types):")
     for target_def in target_vars:
         t_name = target_def["user_name"]
@@ -3,9 +3,46 @@
 import numpy as np
 
 def latlon_to_xyz(lat, lon):
-    lat_rad = np.radians(lat)
-    lon_rad = np.radians(lon)
-    x = np.cos(lat_rad) * np.cos(lon_rad)
-    y = np.cos(lat_rad) * np.sin(lon_rad)
-    z = np.sin(lat_rad)
-    return x, y, z
+    """Converts arrays of latitudes/longitudes in degrees to an (N, 3) array of unit vectors."""
+    lat_rad = np.radians(np.ravel(lat))
+    lon_rad = np.radians(np.ravel(lon))
+    cos_lat = np.cos(lat_rad)
+    # Each component is written straight into its column of one C-contiguous buffer, with no stacking copy
+    xyz = np.empty((lat_rad.size, 3), dtype=np.float64)
+    np.multiply(cos_lat, np.cos(lon_rad), out=xyz[:, 0])
+    np.multiply(cos_lat, np.sin(lon_rad), out=xyz[:, 1])
+    np.sin(lat_rad, out=xyz[:, 2])
+    return xyz
+
+def grib_message_length(header):
+    """
+    Returns the total length of the GRIB message whose Section 0 starts
+    header (at least 16 bytes), or None if it is not a GRIB1/GRIB2 header.
+    """
+    if bytes(header[:4]) != b'GRIB':
+        return None
+    edition = header[7]
+    if edition == 2:
+        return int.from_bytes(header[8:16], 'big') # Section 0 carries an 8-byte total length
+    if edition == 1:
+        return int.from_bytes(header[4:7], 'big')
+    return None
+
+def split_grib_messages(buf):
+    """Splits an in-memory GRIB file into zero-copy memoryview slices, one per message."""
+    view = memoryview(buf)
+    messages = []
+    offset = 0
+    while True:
+        start = buf.find(b'GRIB', offset)
+        if start == -1 or start + 16 > len(buf):
+            break
+        length = grib_message_length(view[start:start + 16])
+        if length is None:
+            offset = start + 4 # Not a real message header, keep scanning
+            continue
+        if length <= 0 or start + length > len(buf):
+            break # Truncated trailing message
+        messages.append(view[start:start + length])
+        offset = start + length
+    return messages